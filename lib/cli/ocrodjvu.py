@@ -19,17 +19,19 @@ from __future__ import unicode_literals
 from future import standard_library
 standard_library.install_aliases()
 from builtins import str
-from builtins import range
 from builtins import object
 import argparse
+import collections
+import concurrent.futures
 import contextlib
-import inspect
+import functools
+import io
 import locale
 import os.path
+import re
 import shutil
 import string
 import sys
-import threading
 import traceback
 
 from .. import cli
@@ -54,19 +56,27 @@ logger = logger.setup()
 
 class Saver(object):
 
+    __slots__ = ()
+
     in_place = False
+    n_init_args = 0
 
     def __init__(self):
         pass
 
-    @classmethod
-    def get_n_args(cls):
-        init_args, _, _, _ = inspect.getargspec(cls.__init__)
-        return len(init_args) - 1
-
     def check(self):
         pass
 
+    def begin(self, djvu_path, sed_file):
+        '''
+        Return a file-like object that the djvused script should be written
+        to, while pages are being processed.
+        '''
+        return sed_file
+
+    def abort(self):
+        pass
+
     @utils.not_overridden
     def save(self, document, pages, djvu_path, sed_file):
         raise NotImplementedError('Cannot save results in this format')  # no coverage
@@ -76,6 +86,9 @@ class BundledSaver(Saver):
     '''save results as a bundled multi-page document'''
 
     options = '-o', '--save-bundled'
+    n_init_args = 1
+
+    __slots__ = ('_ips', '_save_path')
 
     def __init__(self, save_path):
         self._ips = InPlaceSaver()
@@ -97,6 +110,9 @@ class IndirectSaver(Saver):
     '''save results as an indirect multi-page document'''
 
     options = '-i', '--save-indirect'
+    n_init_args = 1
+
+    __slots__ = ('_ips', '_save_path')
 
     def __init__(self, save_path):
         self._ips = InPlaceSaver()
@@ -114,6 +130,9 @@ class ScriptSaver(Saver):
     '''save a djvused script with results'''
 
     options = '--save-script',
+    n_init_args = 1
+
+    __slots__ = ('_save_path',)
 
     def __init__(self, save_path):
         self._save_path = os.path.abspath(save_path)
@@ -128,10 +147,38 @@ class InPlaceSaver(Saver):
     options = '--in-place',
     in_place = True
 
+    __slots__ = ('_script',)
+
+    def __init__(self):
+        self._script = None
+
     def check(self):
         ipc.require('djvused')
 
+    def begin(self, djvu_path, sed_file):
+        # Feed the script to djvused as it is being written,
+        # so that djvused can apply it while OCR is still in progress.
+        # Don't use -s: djvused would then save the document whenever its
+        # standard input is closed, even if ocrodjvu died half-way through.
+        # Instead, DjvusedScript.close() issues an explicit "save" command.
+        djvu_path = os.path.abspath(djvu_path)
+        djvused = ipc.Subprocess(
+            ['djvused', djvu_path],
+            stdin=ipc.PIPE,
+        )
+        self._script = DjvusedScript(sed_file, djvused)
+        return self._script
+
+    def abort(self):
+        if self._script is not None:
+            self._script.kill()
+            self._script = None
+
     def save(self, document, pages, djvu_path, sed_file):
+        if self._script is not None:
+            self._script.close()
+            self._script = None
+            return
         sed_file_name = os.path.abspath(sed_file.name)
         djvu_path = os.path.abspath(djvu_path)
         djvused = ipc.Subprocess(
@@ -139,23 +186,93 @@ class InPlaceSaver(Saver):
         )
         djvused.wait()
 
+class DjvusedScript(object):
+
+    '''
+    djvused script that is written both to a file
+    and to standard input of a running djvused process.
+    '''
+
+    def __init__(self, sed_file, djvused):
+        self._sed_file = sed_file
+        self._djvused = djvused
+        self.encoding = sed_file.encoding
+        self._stdin = io.TextIOWrapper(djvused.stdin, encoding=self.encoding)
+
+    def _check_broken_pipe(self):
+        # djvused exited prematurely;
+        # its exit status is more informative than EPIPE.
+        self._djvused.wait()
+
+    def write(self, s):
+        self._sed_file.write(s)
+        try:
+            self._stdin.write(s)
+        except BrokenPipeError:
+            self._check_broken_pipe()
+            raise
+
+    def flush(self):
+        self._sed_file.flush()
+        try:
+            self._stdin.flush()
+        except BrokenPipeError:
+            self._check_broken_pipe()
+            raise
+
+    def close(self):
+        try:
+            # The script file is left without it; it is meant for djvused -s.
+            self._stdin.write('save\n')
+            self._stdin.close()
+        except BrokenPipeError:
+            self._check_broken_pipe()
+            raise
+        self._djvused.wait()
+
+    def kill(self):
+        self._djvused.kill()
+        try:
+            self._stdin.close()
+        except EnvironmentError:
+            pass
+        try:
+            self._djvused.wait()
+        except ipc.CalledProcessError:
+            pass
+
 class DryRunSaver(Saver):
 
     '''don't change any files'''
 
     options = '--dry-run',
 
+    __slots__ = ()
+
     def save(self, document, pages, djvu_path, sed_file):
         pass
 
-def expand_template(template, pageno, pageid):
-    d = {
-        'page': pageno,
-        'id': pageid,
-        'id-ext': os.path.splitext(pageid)[0],
-    }
-    formatter = string.Formatter()
-    for _, var, _, _ in formatter.parse(template):
+class TemplateFields(dict):
+
+    '''
+    Fields available in filename templates.
+    'id-ext' is computed only if the template asks for it.
+    '''
+
+    def __missing__(self, key):
+        if key == 'id-ext':
+            value = self[key] = os.path.splitext(self['id'])[0]
+            return value
+        raise KeyError(key)
+
+@functools.lru_cache(maxsize=None)
+def compile_template(template):
+    '''
+    Parse the filename template once;
+    return a function that expands it for the given pageno and pageid.
+    '''
+    offsets = []
+    for _, var, _, _ in string.Formatter().parse(template):
         if var is None:
             continue
         if '+' in var:
@@ -170,14 +287,47 @@ def expand_template(template, pageno, pageid):
             offset = sign * int(offset, 10)
         except ValueError:
             continue
-        try:
-            base_value = d[base_var]
-        except LookupError:
-            continue
-        if not isinstance(base_value, int):
-            continue
-        d[var] = d[base_var] + offset
-    return formatter.vformat(template, (), d)
+        offsets += [(var, base_var, offset)]
+    def expand(pageno, pageid):
+        d = TemplateFields(page=pageno, id=pageid)
+        for var, base_var, offset in offsets:
+            try:
+                base_value = d[base_var]
+            except LookupError:
+                continue
+            if not isinstance(base_value, int):
+                continue
+            d[var] = base_value + offset
+        # str.format_map() understands the same syntax as
+        # string.Formatter.vformat(), but it's implemented in C.
+        return template.format_map(d)
+    return expand
+
+def expand_template(template, pageno, pageid):
+    return compile_template(template)(pageno, pageid)
+
+_djvused_special_chars_replace = re.compile(r"[\\']").sub
+
+def djvused_escape(s):
+    '''
+    Escape backslashes and apostrophes for use in a quoted djvused string.
+    '''
+    return _djvused_special_chars_replace(r'\\\g<0>', s)
+
+def djvused_select(page):
+    '''
+    Return the djvused command that selects the page.
+    '''
+    try:
+        file_id = page.file.id
+    except UnicodeError:
+        pageno = page.n + 1
+        logger.warning('warning: cannot convert page {n} identifier to locale encoding'.format(n=pageno))
+        return 'select {n}\n'.format(n=pageno)
+    else:
+        return "select '{fileid}'\n".format(
+            fileid=djvused_escape(file_id)
+        )
 
 class EngineChoices(object):
 
@@ -245,7 +395,7 @@ class ArgumentParser(cli.ArgumentParser):
         saver_group = group.add_mutually_exclusive_group(required=True)
         for saver_type in self.savers:
             options = saver_type.options
-            n_args = saver_type.get_n_args()
+            n_args = saver_type.n_init_args
             metavar = [None, 'FILE'][n_args]
             saver_group.add_argument(
                 *options,
@@ -391,12 +541,6 @@ class ArgumentParser(cli.ArgumentParser):
             options.n_jobs = utils.get_cpu_count()
         return options
 
-class Results(dict):
-    seen_exception = False
-
-    def __missing__(self, key):
-        return
-
 class Context(djvu.decode.Context):
 
     def init(self, options):
@@ -405,6 +549,9 @@ class Context(djvu.decode.Context):
         self._options = options
         bpp = 24 if self._options.render_layers != djvu.decode.RENDER_MASK_ONLY else 1
         self._image_format = self._options.engine.image_format(bpp)
+        if options.save_raw_ocr_dir is not None:
+            # The template is validated only if it will be used.
+            self._raw_ocr_template = compile_template(options.raw_ocr_filename_template)
 
     def _temp_file(self, name, mode='w+', encoding=locale.getpreferredencoding(),auto_remove=True):
         path = os.path.join(self._temp_dir, name)
@@ -435,12 +582,11 @@ class Context(djvu.decode.Context):
         output_dir = self._options.save_raw_ocr_dir
         if output_dir is None:
             return
-        template = self._options.raw_ocr_filename_template
         pageid = page.file.id
         pageno = page.n + 1
         prefix = os.path.join(
             output_dir,
-            expand_template(template, pageno=pageno, pageid=pageid),
+            self._raw_ocr_template(pageno=pageno, pageid=pageid),
         )
         result.save(prefix)
 
@@ -454,68 +600,55 @@ class Context(djvu.decode.Context):
             raise page_job.status
         size = page_job.size
         with self.get_output_image(page.n, page_job) as pfile:
-            result = self._engine.recognize(pfile, language=self._options.language, details=self._options.details, uax29=self._options.uax29)
+            result = self._engine.recognize(pfile, **self._recognize_kwargs)
             if self._debug:
                 result.save(os.path.join(self._temp_dir, '{n:06}'.format(n=page.n)))
             self.save_raw_ocr(page, result)
             [text] = self._engine.extract_text(result.as_stringio(),
                 rotation=page.rotation,
-                details=self._options.details,
-                uax29=self._options.uax29,
-                html5=self._options.html5,
-                fix_utf8=self._engine.needs_utf8_fix,
-                page_size=size
+                page_size=size,
+                **self._extract_kwargs
             )
             # It should be: (page 0 0 <width> <height> …):
             assert len(text) > 5
             return text
 
-    def page_thread(self, pages, results, condition):
-        for page in pages:
-            n = page.n
-            with condition:
-                result = results[n]
-                if result is not None:
-                    # The page is being processed or has been already processed.
-                    continue
-                # Mark the page as taken.
-                results[n] = True
-            try:
-                result = self.process_page(page)
-            except djvu.decode.NotAvailable:
-                logger.info('No image suitable for OCR.')
-                result = False
-            except (SystemExit, KeyboardInterrupt) as ex:
-                with condition:
-                    condition.notify()
-                raise
-            except Exception as ex:
-                try:
-                    interrupted_by_user = isinstance(ex, ipc.CalledProcessInterrupted) and ex.by_user
-                    message = 'Exception while processing page {n}:\n{tb}'.format(
-                        n=(n + 1),
-                        tb=traceback.format_exc()
-                    )
-                    logger.error(message.rstrip())
-                    if self._options.resume_on_error and not interrupted_by_user:
-                        # As requested by user, don't abort on error and pretend that nothing happened.
-                        results[n] = False
-                        results.seen_exception = True
-                        continue
-                    else:
-                        # The main thread will take care of aborting the application.
-                        results[n] = ex
-                        return
-                finally:
-                    with condition:
-                        condition.notify()
-            with condition:
-                assert results[n] is True
-                results[n] = result
-                condition.notify()
+    def page_thread(self, page):
+        try:
+            return self.process_page(page)
+        except djvu.decode.NotAvailable:
+            logger.info('No image suitable for OCR.')
+            return False
+        except Exception as ex:
+            interrupted_by_user = isinstance(ex, ipc.CalledProcessInterrupted) and ex.by_user
+            message = 'Exception while processing page {n}:\n{tb}'.format(
+                n=(page.n + 1),
+                tb=traceback.format_exc()
+            )
+            logger.error(message.rstrip())
+            if self._options.resume_on_error and not interrupted_by_user:
+                # As requested by user, don't abort on error and pretend that nothing happened.
+                self._seen_exception = True
+                return False
+            # The main thread will take care of aborting the application.
+            raise
 
     def _process(self, path, pages=None):
-        self._engine = self._options.engine
+        options = self._options
+        self._engine = engine = options.engine
+        # Keyword arguments that are the same for every page:
+        self._recognize_kwargs = dict(
+            language=options.language,
+            details=options.details,
+            uax29=options.uax29,
+        )
+        self._extract_kwargs = dict(
+            details=options.details,
+            uax29=options.uax29,
+            html5=options.html5,
+            fix_utf8=engine.needs_utf8_fix,
+        )
+        self._seen_exception = False
         logger.info('Processing {path}:'.format(path=path))
         document = self.new_document(djvu.decode.FileURI(path))
         document.decoding_job.wait()
@@ -523,80 +656,66 @@ class Context(djvu.decode.Context):
             pages = list(document.pages)
         else:
             pages = [document.pages[i - 1] for i in pages]
-        results = Results()
-        njobs = self._options.n_jobs
+        njobs = options.n_jobs
         thread_limit = utils.get_thread_limit(len(pages), njobs)
         os.environ['OMP_THREAD_LIMIT'] = str(thread_limit)
-        condition = threading.Condition()
-        threads = [
-            threading.Thread(target=self.page_thread, args=(pages, results, condition))
-            for i in range(njobs)
-        ]
-        def stop_threads():
-            with condition:
-                for page in pages:
-                    # Worker threads should not bother with processing other pages.
-                    # Mark them as already taken.
-                    results[page.n] = True
-        for thread in threads:
-            thread.start()
+        set_txt_commands = collections.deque(
+            djvused_select(page) + 'set-txt\n'
+            for page in pages
+        )
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=njobs)
+        # Pages are submitted in reading order, so worker threads pick them up
+        # in the same order as the main thread consumes the results.
+        futures = collections.deque(
+            executor.submit(self.page_thread, page)
+            for page in pages
+        )
         sed_file = self._temp_file('ocrodjvu.djvused', auto_remove=False)
+        saver = options.saver
         try:
-            if self._options.clear_text:
-                sed_file.write('remove-txt\n')
+            script = saver.begin(path, sed_file)
+            if options.clear_text:
+                script.write('remove-txt\n')
             for page in pages:
+                script.write(set_txt_commands.popleft())
+                # Drop the future as soon as possible,
+                # so that the result is kept in memory only as long as necessary.
+                future = futures.popleft()
                 try:
-                    file_id = page.file.id
-                except UnicodeError:
-                    pageno = page.n + 1
-                    logger.warning('warning: cannot convert page {n} identifier to locale encoding'.format(n=pageno))
-                    sed_file.write('select {n}\n'.format(n=pageno))
-                else:
-                    sed_file.write("select '{fileid}'\n".format(
-                        fileid=file_id.replace('\\', '\\\\').replace("'", "\\'")
-                    ))
-                sed_file.write('set-txt\n')
-                result = None
-                with condition:
-                    while True:
-                        result = results[page.n]
-                        if result is None or result is True:
-                            # Result is not yet available.
-                            condition.wait()
-                            continue
-                        results[page.n] = Ellipsis  # no longer needed
-                        if isinstance(result, Exception):
-                            stop_threads()
-                        break
-                if isinstance(result, Exception):
-                    if len(threads) > 1:
+                    result = future.result()
+                except Exception:
+                    for pending in futures:
+                        # Worker threads should not bother with processing other pages.
+                        pending.cancel()
+                    if njobs > 1:
                         logger.info('Waiting for other threads to finish...')
-                    for thread in threads:
-                        thread.join()
+                    executor.shutdown(wait=True)
                     self._debug = True
                     sys.exit(errors.EXIT_FATAL)
                 if result is False:
                     # No image suitable for OCR.
                     pass
                 else:
-                    text_zones.print_sexpr(result, sed_file)
-                result = None  # no longer needed
-                sed_file.write('\n.\n\n')
-            sed_file.flush()
-            saver = self._options.saver
+                    text_zones.print_sexpr(result, script)
+                result = future = None  # no longer needed
+                script.write('\n.\n\n')
+            script.flush()
             if saver.in_place:
                 document = None
             pages_to_save = None
-            if self._options.ocr_only:
+            if options.ocr_only:
                 pages_to_save = [page.n for page in pages]
-            self._options.saver.save(document, pages_to_save, path, sed_file)
+            saver.save(document, pages_to_save, path, sed_file)
             document = None
         except:
-            stop_threads()
+            for pending in futures:
+                pending.cancel()
+            saver.abort()
             raise
         finally:
+            executor.shutdown(wait=False)
             sed_file.close()
-        if results.seen_exception:
+        if self._seen_exception:
             sys.exit(errors.EXIT_NONFATAL)
 
     def process(self, *args, **kwargs):
@@ -609,6 +728,7 @@ class Context(djvu.decode.Context):
             raise
 
     def close(self):
+        self._options.engine.close()
         if self._debug:
             return self._temp_dir
         else:
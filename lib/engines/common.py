@@ -46,6 +46,9 @@ class Engine(object):
                 raise
             setattr(self, key, value)
 
+    def close(self):
+        pass
+
 class Output(object):
 
     format = None
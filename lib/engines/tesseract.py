@@ -18,14 +18,17 @@ from __future__ import unicode_literals
 
 from builtins import object
 import cgi
+import contextlib
 import glob
 import os
 import re
 import shlex
 import sys
+import threading
 import warnings
 import locale
 import codecs
+import functools
 
 from . import common
 from .. import errors
@@ -44,6 +47,8 @@ _error_pattern = re.compile(
     re.MULTILINE
 )
 
+_version_pattern = re.compile(r'^tesseract\s+v?([0-9]+)[.]([0-9]+)', re.MULTILINE)
+
 _bbox_extras_template = '''\
 <!-- The following script was appended to hOCR by ocrodjvu for internal purposes. -->
 <script type='application/x-ocrodjvu-tesseract'>
@@ -65,8 +70,10 @@ def _filter_boring_stderr(stderr):
         # because we always pass just a single page to Tesseract.
         del stderr[0]
 
-def _wait_for_worker(worker):
-    stderr = worker.stderr.read().splitlines()
+def _wait_for_worker(worker, stderr=None):
+    if stderr is None:
+        stderr = worker.stderr.read()
+    stderr = stderr.splitlines()
     def print_errors():
         for line in stderr:
             print('tesseract: {0}'.format(line), file=sys.stderr)
@@ -101,8 +108,102 @@ def fix_html(s):
         for n, chunk in enumerate(regex.split(s))
     )
 
+@functools.lru_cache(maxsize=None)
+def _get_filesystem_info(executable):
+    '''
+    Return (data directory, data file extension, unexpected exit code flag)
+    for the Tesseract executable.
+
+    Finding them out requires running Tesseract, so the result is cached.
+    '''
+    unexpected_exit_code = False
+    try:
+        tesseract = ipc.Subprocess([executable, '', '', '-l', 'nonexistent'],
+            stdin=ipc.DEVNULL,
+            stdout=ipc.DEVNULL,
+            stderr=ipc.PIPE,
+        )
+    except OSError:
+        raise errors.UnknownLanguageList
+    tesseract.stdout=codecs.getreader(sys.stdout.encoding or locale.getpreferredencoding())(tesseract.stdout)
+    tesseract.stderr=codecs.getreader(sys.stdout.encoding or locale.getpreferredencoding())(tesseract.stderr)
+    try:
+        stderr = tesseract.stderr.read()
+        match = _error_pattern.search(stderr)
+        if match is None:
+            raise errors.UnknownLanguageList
+        directory = match.group('dir')
+        extension = match.group('ext')
+        if not os.path.isdir(directory):
+            raise errors.UnknownLanguageList
+    finally:
+        try:
+            tesseract.wait()
+        except ipc.CalledProcessError:
+            pass
+        else:
+            unexpected_exit_code = True
+    return directory, extension, unexpected_exit_code
+
+@functools.lru_cache(maxsize=None)
+def _get_version(executable):
+    '''
+    Return the (major, minor) version of the Tesseract executable,
+    or None if it cannot be determined.
+    '''
+    try:
+        tesseract = ipc.Subprocess([executable, '--version'],
+            stdin=ipc.DEVNULL,
+            stdout=ipc.PIPE,
+            stderr=ipc.PIPE,
+        )
+    except OSError:
+        return
+    # Tesseract < 4 prints its version on stderr.
+    output = b''.join(tesseract.communicate())
+    try:
+        tesseract.wait()
+    except ipc.CalledProcessError:
+        # Very old versions don't know about --version.
+        pass
+    match = _version_pattern.search(output.decode('ASCII', 'replace'))
+    if match is None:
+        return
+    return tuple(map(int, match.groups()))
+
+def _user_to_iso639(language):
+    match = _language_pattern.match(language)
+    if match is None:
+        return language
+    isocode = iso639.b_to_t(match.group(1))
+    if match.group(2) is not None:
+        isocode += '-' + match.group(2)
+    return isocode
+
+@functools.lru_cache(maxsize=None)
+def _get_language_map(directory, extension):
+    '''
+    Return a mapping from ISO 639 codes to Tesseract language codes
+    for the training data files found in the directory.
+    '''
+    result = {}
+    wildcard = '*.{ext}'.format(ext=extension)
+    for filename in glob.iglob(os.path.join(directory, wildcard)):
+        filename = os.path.basename(filename)
+        code = os.path.splitext(filename)[0]
+        if code == 'osd':
+            continue
+        try:
+            isocode = _user_to_iso639(code)
+        except errors.InvalidLanguageId:
+            continue
+        result[isocode] = code
+    return result
+
 class ExtractSettings(object):
 
+    __slots__ = ('rotation', 'page_size')
+
     def __init__(self, rotation=0, page_size=None, **kwargs):
         self.rotation = rotation
         self.page_size = page_size
@@ -135,66 +236,32 @@ class Engine(common.Engine):
             self._hocr = None
         self._user_to_tesseract = None  # to be defined later
         self._languages = list(self._get_languages())
+        self._tessconf = None  # to be created when first needed
+        self._tessconf_lock = threading.Lock()
+        self._closed = False
+        # Tesseract >= 3.04 can write its output to stdout,
+        # so that there's no need for temporary output files.
+        self._output_to_stdout = (_get_version(self.executable) or (0, 0)) >= (3, 4)
 
     def get_filesystem_info(self):
-        try:
-            tesseract = ipc.Subprocess([self.executable, '', '', '-l', 'nonexistent'],
-                stdin=ipc.DEVNULL,
-                stdout=ipc.DEVNULL,
-                stderr=ipc.PIPE,
-            )
-        except OSError:
-            raise errors.UnknownLanguageList
-        tesseract.stdout=codecs.getreader(sys.stdout.encoding or locale.getpreferredencoding())(tesseract.stdout)
-        tesseract.stderr=codecs.getreader(sys.stdout.encoding or locale.getpreferredencoding())(tesseract.stderr)
-        try:
-            stderr = tesseract.stderr.read()
-            match = _error_pattern.search(stderr)
-            if match is None:
-                raise errors.UnknownLanguageList
-            directory = match.group('dir')
-            extension = match.group('ext')
-            if not os.path.isdir(directory):
-                raise errors.UnknownLanguageList
-        finally:
-            try:
-                tesseract.wait()
-            except ipc.CalledProcessError:
-                pass
-            else:
-                # This should never happen. Recognizing non-existent image
-                # should always fail. But apparently there are Subversion
-                # snapshots of Tesseract in the wild that do it wrongly. Rather
-                # than failing hard, issue a warning:
-                warnings.warn('unexpected exit code from Tesseract', category=RuntimeWarning, stacklevel=2)
+        directory, extension, unexpected_exit_code = _get_filesystem_info(self.executable)
+        if unexpected_exit_code:
+            # This should never happen. Recognizing non-existent image
+            # should always fail. But apparently there are Subversion
+            # snapshots of Tesseract in the wild that do it wrongly. Rather
+            # than failing hard, issue a warning:
+            warnings.warn('unexpected exit code from Tesseract', category=RuntimeWarning, stacklevel=2)
         return directory, extension
 
     def list_languages(self):
         return iter(self._languages)
 
     def _get_languages(self):
-        self._user_to_tesseract = {}
-        wildcard = '*.{ext}'.format(ext=self._extension)
-        for filename in glob.iglob(os.path.join(self._directory, wildcard)):
-            filename = os.path.basename(filename)
-            code = os.path.splitext(filename)[0]
-            if code == 'osd':
-                continue
-            try:
-                isocode = self.user_to_iso639(code)
-            except errors.InvalidLanguageId:
-                continue
-            self._user_to_tesseract[isocode] = code
-            yield isocode
+        self._user_to_tesseract = dict(_get_language_map(self._directory, self._extension))
+        return iter(self._user_to_tesseract)
 
     def user_to_iso639(self, language):
-        match = _language_pattern.match(language)
-        if match is None:
-            return language
-        isocode = iso639.b_to_t(match.group(1))
-        if match.group(2) is not None:
-            isocode += '-' + match.group(2)
-        return isocode
+        return _user_to_iso639(language)
 
     def user_to_tesseract(self, language):
         result = []
@@ -210,8 +277,27 @@ class Engine(common.Engine):
     def check_language(self, language):
         self.user_to_tesseract(language)
 
+    def _recognize_to_stdout(self, commandline):
+        worker = ipc.Subprocess(
+            commandline,
+            stdin=ipc.DEVNULL,
+            stdout=ipc.PIPE,
+            stderr=ipc.PIPE,
+        )
+        contents, stderr = worker.communicate()
+        stderr = stderr.decode(sys.stderr.encoding or locale.getpreferredencoding())
+        _wait_for_worker(worker, stderr=stderr)
+        return contents.decode(locale.getpreferredencoding())
+
     def recognize_plain_text(self, image, language, details=None, uax29=None):
         language = self.user_to_tesseract(language)
+        if self._output_to_stdout:
+            return common.Output(
+                self._recognize_to_stdout(
+                    [self.executable, image.name, 'stdout', '-l', language] + self.extra_args
+                ),
+                format='txt',
+            )
         with temporary.directory() as output_dir:
             worker = ipc.Subprocess(
                 [self.executable, image.name, os.path.join(output_dir, 'tmp'), '-l', language] + self.extra_args,
@@ -227,46 +313,63 @@ class Engine(common.Engine):
                     format='txt',
                 )
 
+    def _create_tessconf(self):
+        tessconf = temporary.file(mode='wt', suffix='.tessconf')
+        # Tesseract 3.00 doesn't come with any config file to enable hOCR
+        # output. Let's create our own one.
+        print('tessedit_create_hocr T', file=tessconf)
+        tessconf.flush()
+        return tessconf
+
+    @contextlib.contextmanager
+    def _tessconf_path(self):
+        # The config file is the same for every page,
+        # so create it only once.
+        with self._tessconf_lock:
+            if self._tessconf is None and not self._closed:
+                self._tessconf = self._create_tessconf()
+            tessconf = self._tessconf
+        if tessconf is not None:
+            yield tessconf.name
+            return
+        # The engine has already been closed, but pages that are still being
+        # processed (e.g. after Ctrl-C) need a config file, too.
+        # Don't leave behind a shared one that nobody would remove.
+        with self._create_tessconf() as tessconf:
+            yield tessconf.name
+
+    def close(self):
+        with self._tessconf_lock:
+            self._closed = True
+            if self._tessconf is not None:
+                self._tessconf.close()
+                self._tessconf = None
+
     def recognize_hocr(self, image, language, details=text_zones.TEXT_DETAILS_WORD, uax29=None):
         language = self.user_to_tesseract(language)
         character_details = (
             details < text_zones.TEXT_DETAILS_WORD or
             (uax29 and details <= text_zones.TEXT_DETAILS_WORD)
         )
-        with temporary.directory() as output_dir:
-            tessconf_path = os.path.join(output_dir, 'tessconf')
-            with open(tessconf_path, 'wt') as tessconf:
-                # Tesseract 3.00 doesn't come with any config file to enable hOCR
-                # output. Let's create our own one.
-                print('tessedit_create_hocr T', file=tessconf)
-            commandline = (
-                [self.executable, image.name, os.path.join(output_dir, 'tmp')] +
-                ['-l', language] +
-                self.extra_args +
-                [tessconf_path]
-            )
-            if character_details:
-                commandline += ['makebox']
-            worker = ipc.Subprocess(
-                commandline,
-                stdin=ipc.DEVNULL,
-                stdout=ipc.DEVNULL,
-                stderr=ipc.PIPE,
-            )
-            worker.stderr=codecs.getreader(sys.stderr.encoding or locale.getpreferredencoding())(worker.stderr)
-            _wait_for_worker(worker)
-            hocr_path = os.path.join(output_dir, 'tmp.hocr')
-            if not os.path.exists(hocr_path):
-                hocr_path = hocr_path[:-4] + 'html'
-            with open(os.path.join(output_dir, hocr_path), 'r') as hocr_file:
-                contents = hocr_file.read()
-            if character_details:
-                assert commandline[-1] == 'makebox'
-                assert commandline[-2] == tessconf_path
-                box_path = os.path.join(output_dir, 'tmp.box')
-                if not os.path.exists(box_path):
-                    # Tesseract << 3.04
-                    del commandline[-2]
+        with self._tessconf_path() as tessconf_path:
+            if self._output_to_stdout and not character_details:
+                # With makebox, the box file would be written to stdout, too.
+                contents = self._recognize_to_stdout(
+                    [self.executable, image.name, 'stdout'] +
+                    ['-l', language, '-c', 'tessedit_create_txt=0'] +
+                    self.extra_args +
+                    [tessconf_path]
+                )
+            else:
+                with temporary.directory() as output_dir:
+                    commandline = (
+                        [self.executable, image.name, os.path.join(output_dir, 'tmp')] +
+                        ['-l', language] +
+                        self.extra_args +
+                        [tessconf_path]
+                    )
+                    if character_details:
+                        commandline += ['makebox']
                     worker = ipc.Subprocess(
                         commandline,
                         stdin=ipc.DEVNULL,
@@ -275,11 +378,31 @@ class Engine(common.Engine):
                     )
                     worker.stderr=codecs.getreader(sys.stderr.encoding or locale.getpreferredencoding())(worker.stderr)
                     _wait_for_worker(worker)
-                with open(box_path, 'r') as box_file:
-                    contents = contents.replace(
-                        '</body>',
-                        _bbox_extras_template.format(box_file.read()) + '</body>'
-                    )
+                    hocr_path = os.path.join(output_dir, 'tmp.hocr')
+                    if not os.path.exists(hocr_path):
+                        hocr_path = hocr_path[:-4] + 'html'
+                    with open(os.path.join(output_dir, hocr_path), 'r') as hocr_file:
+                        contents = hocr_file.read()
+                    if character_details:
+                        assert commandline[-1] == 'makebox'
+                        assert commandline[-2] == tessconf_path
+                        box_path = os.path.join(output_dir, 'tmp.box')
+                        if not os.path.exists(box_path):
+                            # Tesseract << 3.04
+                            del commandline[-2]
+                            worker = ipc.Subprocess(
+                                commandline,
+                                stdin=ipc.DEVNULL,
+                                stdout=ipc.DEVNULL,
+                                stderr=ipc.PIPE,
+                            )
+                            worker.stderr=codecs.getreader(sys.stderr.encoding or locale.getpreferredencoding())(worker.stderr)
+                            _wait_for_worker(worker)
+                        with open(box_path, 'r') as box_file:
+                            contents = contents.replace(
+                                '</body>',
+                                _bbox_extras_template.format(box_file.read()) + '</body>'
+                            )
         if self.fix_html:
             contents = fix_html(contents)
         return common.Output(
@@ -126,8 +126,22 @@ class Subprocess(subprocess.Popen):
             ex.filename = self.__command
             raise
 
+    __communicating = False
+
+    def communicate(self, *args, **kwargs):
+        # subprocess.Popen.communicate() calls wait() internally. Don't let it
+        # raise, or the output would be lost; the caller is expected to call
+        # wait() afterwards to check the exit status.
+        self.__communicating = True
+        try:
+            return subprocess.Popen.communicate(self, *args, **kwargs)
+        finally:
+            self.__communicating = False
+
     def wait(self, *args, **kwargs):
         return_code = subprocess.Popen.wait(self, *args, **kwargs)
+        if self.__communicating:
+            return return_code
         if return_code > 0:
             raise CalledProcessError(return_code, self.__command)
         if return_code < 0:
@@ -48,24 +48,35 @@ def parse_page_numbers(pages):
     '''
     if pages is None:
         return
-    result = []
-    for page_range in pages.split(','):
-        if '-' in page_range:
-            x, y = list(map(int, page_range.split('-', 1)))
-            result += range(x, y + 1)
-        else:
-            result += [int(page_range, 10)]
-    return result
+    return [
+        n
+        for page_range in pages.split(',')
+        for n in _parse_page_range(page_range)
+    ]
+
+def _parse_page_range(page_range):
+    if '-' in page_range:
+        x, y = map(int, page_range.split('-', 1))
+        return range(x, y + 1)
+    else:
+        return (int(page_range, 10),)
 
 _special_chars_replace = re.compile(r'''[\x00-\x1F'"\x5C\x7F-\x9F]''').sub
 
-def _special_chars_escape(m):
-    ch = m.group(0)
+def _escape_special_char(ch):
     if ch in {'"', "'"}:
         return '\\' + ch
     else:
         return '\\'+repr(ch)[2:-1]
 
+_special_chars_escapes = dict(
+    (ch, _escape_special_char(ch))
+    for ch in ['"', "'", '\\'] + [chr(i) for i in range(0x20)] + [chr(i) for i in range(0x7F, 0xA0)]
+)
+
+def _special_chars_escape(m):
+    return _special_chars_escapes[m.group(0)]
+
 def smart_repr(s, encoding=None):
     if encoding is None:
         return repr(s)
@@ -85,6 +96,7 @@ class EncodingWarning(UserWarning):
     pass
 
 _control_characters_regex = re.compile(rb'(?![\n\r\t])\p{Cc}')
+_replacement_character_utf8 = '\N{REPLACEMENT CHARACTER}'.encode('UTF-8')
 
 def sanitize_utf8(text):
     '''
@@ -92,9 +104,10 @@ def sanitize_utf8(text):
     and space) with Unicode replacement characters.
     '''
     try:
-        text = text.decode('UTF-8')
+        text.decode('UTF-8')
     except UnicodeDecodeError as exc:
-        text = text.decode('UTF-8', 'replace')
+        # Valid UTF-8 doesn't need to be re-encoded.
+        text = text.decode('UTF-8', 'replace').encode('UTF-8')
         message = str(exc)
         message = re.sub("^'utf8' codec can't decode ", '', message)
         warnings.warn(
@@ -102,7 +115,6 @@ def sanitize_utf8(text):
             category=EncodingWarning,
             stacklevel=2,
         )
-    text = text.encode('UTF-8')
     match = _control_characters_regex.search(text)
     if match:
         byte = ord(match.group())
@@ -112,7 +124,9 @@ def sanitize_utf8(text):
             category=EncodingWarning,
             stacklevel=2,
         )
-        text = _control_characters_regex.sub(u'\N{REPLACEMENT CHARACTER}'.encode('UTF-8'), text)
+        # Everything before the first match is known to be clean;
+        # don't scan it again.
+        text = _control_characters_regex.sub(_replacement_character_utf8, text, pos=match.start())
     # There are other code points that are not allowed in XML (or even: not
     # allowed in UTF-8), but which Python happily accept. However, they haven't
     # seemed to occur in real-world documents.
@@ -156,6 +170,11 @@ class property(object):
         self._filter = filter
         self._default_value = default_value
 
+    def __set_name__(self, owner, name):
+        # Python >= 3.6 tells us the attribute name,
+        # which makes for a shorter and more readable private name.
+        self._private_name = '_property_' + name
+
     def __get__(self, instance, cls):
         if instance is None:
             return self
@@ -167,6 +186,12 @@ class property(object):
 
 def get_cpu_count():
     try:
+        # Honor the CPU affinity mask,
+        # which may be narrower than the number of CPUs in the system.
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):  # no coverage
+        pass
+    try:  # no coverage
         import multiprocessing
         return multiprocessing.cpu_count()
     except (ImportError, NotImplementedError):  # no coverage
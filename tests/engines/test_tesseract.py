@@ -0,0 +1,153 @@
+# encoding=UTF-8
+
+# Copyright © 2021 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+from __future__ import unicode_literals
+from builtins import str
+from builtins import object
+import io
+import os
+import shutil
+import sys
+
+from tests.tools import (
+    assert_equal,
+    assert_false,
+    assert_in,
+    assert_is_none,
+    assert_true,
+    interim,
+    interim_environ,
+)
+
+from lib import temporary
+from lib import text_zones
+from lib.engines.tesseract import (
+    Engine,
+    _version_pattern,
+)
+
+here = os.path.dirname(__file__)
+here = os.path.relpath(here)
+
+def _test_version(banner, version):
+    match = _version_pattern.search(banner)
+    if version is None:
+        assert_is_none(match)
+    else:
+        assert_equal(tuple(map(int, match.groups())), version)
+
+def test_version():
+    banners = [
+        # Tesseract < 4 prints this on stderr:
+        ('tesseract 3.02.02\n leptonica-1.69\n  libgif 4.1.6(?) : libjpeg 8d : libpng 1.2.49 : libtiff 3.9.6 : zlib 1.2.7 : webp 0.1.3\n', (3, 2)),
+        ('tesseract 3.04.01\n leptonica-1.73\n  libgif 5.1.4 : libjpeg 8d (libjpeg-turbo 1.5.1) : libpng 1.6.28 : libtiff 4.0.8 : zlib 1.2.8 : libwebp 0.5.2 : libopenjp2 2.1.2\n', (3, 4)),
+        ('tesseract 4.0.0-beta.1\n leptonica-1.75.3\n  libgif 5.1.4 : libjpeg 8d (libjpeg-turbo 1.5.2) : libpng 1.6.34 : libtiff 4.0.9 : zlib 1.2.11 : libwebp 0.6.1 : libopenjp2 2.3.0\n', (4, 0)),
+        ('tesseract v5.0.0-alpha.20200328\n leptonica-1.79.0\n  libgif 5.1.4 : libjpeg 8d (libjpeg-turbo 1.5.3) : libpng 1.6.34 : libtiff 4.0.9 : zlib 1.2.11 : libwebp 0.6.1 : libopenjp2 2.3.0\n', (5, 0)),
+        ('tesseract 5.3.0\n leptonica-1.82.0\n', (5, 3)),
+        # Tesseract << 3.02 doesn't know about --version:
+        ("Usage:tesseract imagename outputbase [-l lang] [configfile [[+|-]varfile]...]\n", None),
+        ('', None),
+    ]
+    for banner, version in banners:
+        yield _test_version, banner, version
+
+class test_tesseract(object):
+
+    fake_executable = 'fake-tesseract'
+    output_to_stdout = True
+
+    def setup(self):
+        self.tmpdir = temporary.raw.mkdtemp(prefix='ocrodjvu.')
+        self.log_path = os.path.join(self.tmpdir, 'log')
+        self.image = temporary.file(dir=self.tmpdir, suffix='.ppm')
+
+    def teardown(self):
+        self.image.close()
+        shutil.rmtree(self.tmpdir)
+
+    def engine(self, **kwargs):
+        return Engine(
+            executable=os.path.join(here, self.fake_executable),
+            **kwargs
+        )
+
+    def recognize(self, engine, **kwargs):
+        stderr = io.StringIO()
+        with interim_environ(fake_tesseract_log=self.log_path):
+            with interim(sys, stderr=stderr):
+                output = engine.recognize(self.image, 'eng', **kwargs)
+        # Tesseract's banner is filtered out; everything else is passed on.
+        assert_equal(stderr.getvalue(), 'tesseract: Warning: fake Tesseract\n')
+        with io.open(self.log_path, 'rt', encoding='UTF-8') as file:
+            args = file.read().splitlines()
+        assert_equal(args[0], self.image.name)
+        return output, args
+
+    def test_output_to_stdout(self):
+        assert_equal(self.engine()._output_to_stdout, self.output_to_stdout)
+
+    def test_languages(self):
+        assert_equal(list(self.engine().list_languages()), ['eng'])
+
+    def test_plain_text(self):
+        output, args = self.recognize(self.engine(use_hocr=0))
+        assert_equal(output.format, 'txt')
+        assert_equal(str(output), 'fake text\n')
+        if self.output_to_stdout:
+            assert_equal(args[1:], ['stdout', '-l', 'eng'])
+        else:
+            assert_equal(args[2:], ['-l', 'eng'])
+
+    def test_hocr(self):
+        output, args = self.recognize(self.engine(), details=text_zones.TEXT_DETAILS_WORD)
+        assert_equal(output.format, 'html')
+        assert_equal(str(output), '<html><body>fake hOCR</body></html>\n')
+        if self.output_to_stdout:
+            assert_equal(args[1:-1], ['stdout', '-l', 'eng', '-c', 'tessedit_create_txt=0'])
+        else:
+            assert_equal(args[2:-1], ['-l', 'eng'])
+        assert_true(args[-1].endswith('.tessconf'))
+
+    def test_hocr_characters(self):
+        # The box file is needed for character details,
+        # so this always goes through temporary files.
+        output, args = self.recognize(self.engine(), details=text_zones.TEXT_DETAILS_CHARACTER)
+        assert_equal(output.format, 'html')
+        assert_in('f 1 2 3 4 0\n', str(output))
+        assert_false(str(output).startswith('<html><body>fake hOCR</body>'))
+        assert_equal(args[-1], 'makebox')
+        assert_true(args[-2].endswith('.tessconf'))
+        assert_equal(args[2:-2], ['-l', 'eng'])
+
+    def test_close(self):
+        engine = self.engine()
+        self.recognize(engine, details=text_zones.TEXT_DETAILS_WORD)
+        with engine._tessconf_path() as tessconf_path:
+            assert_true(os.path.exists(tessconf_path))
+        engine.close()
+        assert_false(os.path.exists(tessconf_path))
+        # Pages still being processed after close()
+        # must not leave a new config file behind.
+        output, args = self.recognize(engine, details=text_zones.TEXT_DETAILS_WORD)
+        assert_equal(str(output), '<html><body>fake hOCR</body></html>\n')
+        assert_false(os.path.exists(args[-1]))
+        assert_is_none(engine._tessconf)
+
+class test_tesseract_3_02(test_tesseract):
+
+    fake_executable = 'fake-tesseract-3.02'
+    output_to_stdout = False
+
+# vim:ts=4 sts=4 sw=4 et
@@ -14,6 +14,7 @@
 # for more details.
 
 from __future__ import unicode_literals
+from builtins import object
 import io
 import os
 import shutil
@@ -25,9 +26,12 @@ from lib.cli import ocrodjvu
 
 from tests.tools import (
     assert_equal,
+    assert_is,
     assert_is_not_none,
     assert_not_equal,
+    assert_not_in,
     interim,
+    interim_environ,
     remove_logging_handlers,
     require_locale_encoding,
     try_run,
@@ -120,4 +124,79 @@ def test_bad_page_id():
     assert_equal(rc, 0)
     assert_equal(stdout.getvalue(), '')
 
+class test_in_place_saver(object):
+
+    def setup(self):
+        here = os.path.dirname(__file__)
+        here = os.path.abspath(here)
+        self.tmpdir = temporary.raw.mkdtemp(prefix='ocrodjvu.')
+        os.symlink(os.path.join(here, 'fake-djvused'), os.path.join(self.tmpdir, 'djvused'))
+        self.log_path = os.path.join(self.tmpdir, 'log')
+        open(self.log_path, 'w').close()
+        self.djvu_path = os.path.join(self.tmpdir, 'tmp.djvu')
+        self.sed_file = temporary.file(mode='w+t', dir=self.tmpdir)
+
+    def teardown(self):
+        self.sed_file.close()
+        shutil.rmtree(self.tmpdir)
+
+    def environ(self):
+        path = os.pathsep.join([self.tmpdir, os.environ['PATH']])
+        return interim_environ(PATH=path, OCRODJVU_TEST_DJVUSED_LOG=self.log_path)
+
+    def read_log(self):
+        with io.open(self.log_path, 'rt', encoding='UTF-8') as file:
+            return file.read()
+
+    def test_save(self):
+        saver = ocrodjvu.InPlaceSaver()
+        with self.environ():
+            script = saver.begin(self.djvu_path, self.sed_file)
+            script.write('remove-txt\n')
+            saver.save(None, None, self.djvu_path, self.sed_file)
+        assert_equal(self.read_log(), self.djvu_path + '\nremove-txt\nsave\n')
+        self.sed_file.seek(0)
+        assert_equal(self.sed_file.read(), 'remove-txt\n')
+
+    def test_abort(self):
+        saver = ocrodjvu.InPlaceSaver()
+        with self.environ():
+            script = saver.begin(self.djvu_path, self.sed_file)
+            script.write('remove-txt\n')
+            script.flush()
+            saver.abort()
+        assert_not_in('save', self.read_log().splitlines())
+
+def test_unused_bad_template():
+    remove_logging_handlers('ocrodjvu.')
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'empty.djvu')
+    for template in '{', '{a+b+c}':
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with interim(sys, stdout=stdout, stderr=stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--raw-ocr-filename-template', template, '--dry-run', path])
+        assert_equal(stderr.getvalue(), '')
+        assert_equal(rc, 0)
+        assert_equal(stdout.getvalue(), '')
+
+def test_expand_template():
+    def t(template, pageno, pageid, expected):
+        assert_equal(ocrodjvu.expand_template(template, pageno=pageno, pageid=pageid), expected)
+    t('{id-ext}', 1, 'p0001.djvu', 'p0001')
+    t('{id}', 1, 'p0001.djvu', 'p0001.djvu')
+    t('{page:04}', 7, 'p0007.djvu', '0007')
+    t('{page+10}_{page-1}', 7, 'p0007.djvu', '17_6')
+
+def test_compile_template():
+    expand = ocrodjvu.compile_template('{page:03}-{id-ext}')
+    assert_is(ocrodjvu.compile_template('{page:03}-{id-ext}'), expand)
+    assert_equal(expand(pageno=1, pageid='a.djvu'), '001-a')
+    assert_equal(expand(pageno=2, pageid='b.djvu'), '002-b')
+
+def test_djvused_escape():
+    assert_equal(ocrodjvu.djvused_escape('p0001.djvu'), 'p0001.djvu')
+    assert_equal(ocrodjvu.djvused_escape("""e'g\\g's"""), """e\\'g\\\\g\\'s""")
+
 # vim:ts=4 sts=4 sw=4 et
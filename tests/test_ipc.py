@@ -98,6 +98,29 @@ class test_wait(object):
         for name in 'SIGINT', 'SIGABRT', 'SIGSEGV':
             yield self._test_signal, name
 
+class test_communicate(object):
+
+    def test0(self):
+        child = ipc.Subprocess(
+            ['sh', '-c', 'printf eggs; printf ham >&2'],
+            stdout=ipc.PIPE, stderr=ipc.PIPE,
+        )
+        stdout, stderr = child.communicate()
+        assert_equal(stdout, b'eggs')
+        assert_equal(stderr, b'ham')
+        child.wait()
+
+    def test1(self):
+        child = ipc.Subprocess(
+            ['sh', '-c', 'printf eggs; printf ham >&2; exit 1'],
+            stdout=ipc.PIPE, stderr=ipc.PIPE,
+        )
+        stdout, stderr = child.communicate()
+        assert_equal(stdout, b'eggs')
+        assert_equal(stderr, b'ham')
+        with assert_raises(ipc.CalledProcessError):
+            child.wait()
+
 class test_environment(object):
 
     # https://bugs.debian.org/594385
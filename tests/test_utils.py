@@ -266,6 +266,14 @@ class test_property(object):
         assert_equal(dummy.eggs, None)
         assert_equal(dummy.ham, 42)
 
+    def test_private_attribute(self):
+        dummy = self.Dummy()
+        dummy._eggs = 'spam'
+        assert_equal(dummy.eggs, None)
+        dummy.eggs = 37
+        assert_equal(dummy._eggs, 'spam')
+        assert_equal(dummy.eggs, 37)
+
 def test_get_cpu_count():
     n = lib.utils.get_cpu_count()
     assert_is_instance(n, int)
@@ -37,6 +37,7 @@ from nose.tools import (
     assert_less_equal,
     assert_multi_line_equal,
     assert_not_equal,
+    assert_not_in,
     assert_raises,
     assert_raises_regexp as assert_raises_regex,
     assert_regexp_matches as assert_regex,
@@ -124,6 +125,7 @@ __all__ = [
     'assert_less_equal',
     'assert_multi_line_equal',
     'assert_not_equal',
+    'assert_not_in',
     'assert_raises',
     'assert_raises_regex',
     'assert_regex',